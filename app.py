@@ -1,40 +1,217 @@
+import json
+import multiprocessing
 import os
-from flask import Flask, render_template, request, jsonify
-from cryptography.fernet import Fernet
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice, repeat
+import click
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+from cache import DecryptCache
+import cipher
+from keys import Keyring, Reencryptor, token_timestamp
+import metrics
+from store import open_store
 
 app = Flask(__name__)
 
-# Load or generate encryption key (for demo; use env var or vault in production)
-KEY_FILE = 'secret.key'
-
-def get_key():
-    if os.path.exists(KEY_FILE):
-        with open(KEY_FILE, 'rb') as f:
-            return f.read()
-    else:
-        key = Fernet.generate_key()
-        with open(KEY_FILE, 'wb') as f:
-            f.write(key)
-        return key
-
-fernet = Fernet(get_key())
-
-SECRETS_FILE = 'secrets.db'
-
-def load_secrets():
-    secrets = {}
-    if os.path.exists(SECRETS_FILE):
-        with open(SECRETS_FILE, 'r') as f:
-            for line in f:
-                parts = line.strip().split(':', 1)
-                if len(parts) == 2:
-                    secrets[parts[0]] = parts[1]
-    return secrets
-
-def save_secrets(secrets):
-    with open(SECRETS_FILE, 'w') as f:
-        for k, v in secrets.items():
-            f.write(f"{k}:{v}\n")
+# Load or generate encryption keys (for demo; use env var or vault in production).
+# The file holds one key per line, newest first; older keys only decrypt.
+KEY_FILE = os.environ.get('KEY_FILE', 'secret.key')
+
+keyring = Keyring(KEY_FILE)
+keyring.fernet()
+
+SECRETS_FILE = os.environ.get('SECRETS_FILE', 'secrets.db')
+
+# "file" rewrites secrets.db on every change; "log" appends records to it and
+# compacts in the background once enough of them are dead; "sqlite" keeps
+# secrets in SQLITE_FILE and imports secrets.db into it the first time
+SECRETS_STORAGE = os.environ.get('SECRETS_STORAGE', 'file')
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'secrets.sqlite3')
+
+if SECRETS_STORAGE == 'log':
+    store = open_store(
+        'log', SECRETS_FILE,
+        fsync_batch=int(os.environ.get('LOG_FSYNC_BATCH', 32)),
+        fsync_interval=float(os.environ.get('LOG_FSYNC_INTERVAL', 0.05)),
+        compact_ratio=float(os.environ.get('LOG_COMPACT_RATIO', 0.5)),
+        compact_min=int(os.environ.get('LOG_COMPACT_MIN', 1024)),
+    )
+elif SECRETS_STORAGE == 'sqlite':
+    store = open_store('sqlite', SQLITE_FILE, migrate_from=SECRETS_FILE)
+else:
+    store = open_store(SECRETS_STORAGE, SECRETS_FILE)
+
+store = metrics.TimedStore(store)
+
+# After a key rotation, existing secrets are re-encrypted with the new key in
+# chunks of ROTATION_CHUNK, at most ROTATION_RATE secrets per second
+ROTATION_CHUNK = int(os.environ.get('ROTATION_CHUNK', 100))
+ROTATION_RATE = float(os.environ.get('ROTATION_RATE', 500))
+
+rotation = Reencryptor(keyring, store, KEY_FILE + '.rotation',
+                       chunk=ROTATION_CHUNK, rate=ROTATION_RATE)
+
+# Batches of at least BATCH_POOL_MIN items can spread Fernet work over a
+# "thread" or "process" pool; by default batches are handled inline
+BATCH_POOL = os.environ.get('BATCH_POOL', '')
+BATCH_POOL_WORKERS = int(os.environ.get('BATCH_POOL_WORKERS', os.cpu_count() or 1))
+BATCH_POOL_MIN = int(os.environ.get('BATCH_POOL_MIN', 64))
+
+_pool = None
+_pool_pid = None
+
+# The file and log stores keep one "name:ciphertext" record per line
+NAME_ERROR = "Name must not contain ':' or line breaks"
+
+def valid_name(name):
+    return not any(c in name for c in ':\r\n')
+
+def _crypto_map(func, values):
+    global _pool, _pool_pid
+    fernet = keyring.fernet()
+    if not BATCH_POOL or len(values) < BATCH_POOL_MIN:
+        return [func(fernet, v) for v in values]
+    # Pools do not survive a fork, so each gunicorn worker creates its own
+    if _pool is None or _pool_pid != os.getpid():
+        if BATCH_POOL == 'process':
+            # spawn rather than fork: forking copies the store's and the
+            # rotation's threads and locks in whatever state they are in
+            _pool = ProcessPoolExecutor(max_workers=BATCH_POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        else:
+            _pool = ThreadPoolExecutor(max_workers=BATCH_POOL_WORKERS)
+        _pool_pid = os.getpid()
+    chunksize = max(1, len(values) // (BATCH_POOL_WORKERS * 4))
+    return list(_pool.map(func, repeat(fernet), values, chunksize=chunksize))
+
+def crypto_map(func, values):
+    if not values:
+        return []
+    op = func.__name__
+    start = time.perf_counter()
+    try:
+        return _crypto_map(func, values)
+    finally:
+        metrics.CRYPTO_SECONDS.labels(op).observe(time.perf_counter() - start)
+        metrics.CRYPTO_VALUES.labels(op).inc(len(values))
+
+# Opt-in cache of decrypted values for hot secrets; 0 entries disables it
+DECRYPT_CACHE_SIZE = int(os.environ.get('DECRYPT_CACHE_SIZE', 0))
+DECRYPT_CACHE_TTL = float(os.environ.get('DECRYPT_CACHE_TTL', 60))
+
+cache = DecryptCache(DECRYPT_CACHE_SIZE, DECRYPT_CACHE_TTL) if DECRYPT_CACHE_SIZE > 0 else None
+
+def decrypt_secrets(found):
+    plain = {}
+    misses = found
+    if cache is not None:
+        misses = {}
+        for name, enc in found.items():
+            value = cache.get(name, enc)
+            if value is None:
+                misses[name] = enc
+            else:
+                plain[name] = value
+        metrics.CACHE_LOOKUPS.labels('hit').inc(len(plain))
+        metrics.CACHE_LOOKUPS.labels('miss').inc(len(misses))
+    for (name, enc), value in zip(misses.items(), crypto_map(cipher.decrypt, list(misses.values()))):
+        plain[name] = value
+        if value is not None and cache is not None:
+            metrics.CACHE_EVICTIONS.inc(cache.put(name, enc, value))
+    return plain
+
+def forget_secrets(names):
+    if cache is not None:
+        for name in names:
+            cache.invalidate(name)
+
+# Export and import move secrets in chunks of STREAM_CHUNK so memory use does
+# not depend on the size of the store
+STREAM_CHUNK = int(os.environ.get('STREAM_CHUNK', 1000))
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+def export_secrets(decrypt=False):
+    for chunk in _chunks(store.iter_items(), STREAM_CHUNK):
+        if not decrypt:
+            for name, enc in chunk:
+                yield {"name": name, "ciphertext": enc}
+            continue
+        values = crypto_map(cipher.decrypt, [enc for _, enc in chunk])
+        for (name, _), value in zip(chunk, values):
+            if value is None:
+                yield {"name": name, "error": "Decryption failed"}
+            else:
+                yield {"name": name, "value": value}
+
+def import_secrets(lines):
+    imported = errors = 0
+    for chunk in _chunks(enumerate(lines, 1), STREAM_CHUNK):
+        plain, encrypted = {}, {}
+        for lineno, line in chunk:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            name = item.get('name') if isinstance(item, dict) else None
+            error = None
+            if not name or not isinstance(name, str):
+                error = "Each line needs a name and a value or ciphertext"
+            elif not valid_name(name):
+                error = NAME_ERROR
+            elif isinstance(item.get('value'), str) and item['value']:
+                plain[name] = item['value']
+                encrypted.pop(name, None)
+            elif isinstance(item.get('ciphertext'), str) and item['ciphertext']:
+                if keyring.verify(item['ciphertext']):
+                    encrypted[name] = item['ciphertext']
+                    plain.pop(name, None)
+                else:
+                    error = "Ciphertext is not a valid token for any key"
+            else:
+                error = "Each line needs a name and a value or ciphertext"
+            if error:
+                errors += 1
+                yield {"line": lineno, "error": error}
+        encrypted.update(zip(plain, crypto_map(cipher.encrypt, list(plain.values()))))
+        if encrypted:
+            store.put_many(encrypted.items())
+            forget_secrets(encrypted)
+        imported += len(encrypted)
+        yield {"imported": imported, "errors": errors}
+
+def _ndjson(items):
+    for item in items:
+        yield json.dumps(item) + '\n'
+
+@app.before_request
+def resume_rotation():
+    rotation.ensure_running()
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+# Clients can send any method token; anything else is labelled "other" so
+# that unknown methods cannot create new time series
+METRIC_METHODS = {'GET', 'HEAD', 'POST', 'DELETE', 'OPTIONS'}
+
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        method = request.method if request.method in METRIC_METHODS else 'other'
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (method, route, response.status_code)
+        metrics.REQUESTS.labels(*labels).inc()
+        metrics.REQUEST_SECONDS.labels(*labels).observe(time.perf_counter() - start)
+    return response
 
 @app.route('/', methods=['GET'])
 def index():
@@ -46,31 +223,129 @@ def add_secret():
     value = request.form.get('value')
     if not name or not value:
         return jsonify({"error": "Both name and value are required"}), 400
-    secrets = load_secrets()
-    secrets[name] = fernet.encrypt(value.encode()).decode()
-    save_secrets(secrets)
+    if not valid_name(name):
+        return jsonify({"error": NAME_ERROR}), 400
+    store.put(name, crypto_map(cipher.encrypt, [value])[0])
+    forget_secrets([name])
     return jsonify({"status": "success"})
 
-@app.route('/secret/<name>', methods=['GET'])
+@app.route('/secret/<path:name>', methods=['GET'])
 def get_secret(name):
-    secrets = load_secrets()
-    enc = secrets.get(name)
+    enc = store.get(name)
     if not enc:
         return jsonify({"error": "Secret not found"}), 404
-    try:
-        secret_value = fernet.decrypt(enc.encode()).decode()
-    except Exception as e:
+    secret_value = decrypt_secrets({name: enc})[name]
+    if secret_value is None:
         return jsonify({"error": "Decryption failed"}), 500
     return jsonify({"secret": secret_value})
 
-@app.route('/secret/<name>', methods=['DELETE'])
+@app.route('/secret/<path:name>', methods=['DELETE'])
 def delete_secret(name):
-    secrets = load_secrets()
-    if name in secrets:
-        del secrets[name]
-        save_secrets(secrets)
+    if store.delete(name):
+        forget_secrets([name])
         return jsonify({"status": "deleted"})
     return jsonify({"error": "Secret not found"}), 404
 
+@app.route('/secrets', methods=['GET'])
+def list_secrets():
+    prefix = request.args.get('prefix', '')
+    cursor = request.args.get('cursor') or None
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= 1000:
+        return jsonify({"error": "limit must be between 1 and 1000"}), 400
+    # Fetch one extra row to know whether another page follows
+    rows = store.scan(prefix, cursor, limit + 1)
+    secrets = [{"name": name, "encrypted_at": token_timestamp(enc)} for name, enc in rows[:limit]]
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return jsonify({"secrets": secrets, "next_cursor": next_cursor})
+
+@app.route('/secrets/batch', methods=['POST'])
+def add_secrets():
+    body = request.get_json(silent=True)
+    items = body.get('secrets') if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "A list of secrets is required"}), 400
+    results = []
+    valid = {}
+    for item in items:
+        name = item.get('name') if isinstance(item, dict) else None
+        value = item.get('value') if isinstance(item, dict) else None
+        if not name or not value or not isinstance(name, str) or not isinstance(value, str):
+            results.append({"name": name, "error": "Both name and value are required"})
+        elif not valid_name(name):
+            results.append({"name": name, "error": NAME_ERROR})
+        else:
+            results.append({"name": name, "status": "success"})
+            valid[name] = value
+    if valid:
+        store.put_many(zip(valid, crypto_map(cipher.encrypt, list(valid.values()))))
+        forget_secrets(valid)
+    return jsonify({"results": results})
+
+@app.route('/secrets/batch', methods=['GET'])
+def get_secrets():
+    names = request.args.getlist('name')
+    if not names:
+        return jsonify({"error": "At least one name is required"}), 400
+    found = store.get_many(names)
+    plain = decrypt_secrets(found)
+    results = []
+    for name in names:
+        if name not in found:
+            results.append({"name": name, "error": "Secret not found"})
+        elif plain[name] is None:
+            results.append({"name": name, "error": "Decryption failed"})
+        else:
+            results.append({"name": name, "secret": plain[name]})
+    return jsonify({"results": results})
+
+@app.route('/keys/rotate', methods=['POST'])
+def rotate_key():
+    state = rotation.status()
+    if state and not state['complete']:
+        return jsonify({"error": "Key rotation already in progress", "rotation": state}), 409
+    keyring.rotate()
+    return jsonify({"status": "rotating", "rotation": rotation.begin()})
+
+@app.route('/keys/rotation', methods=['GET'])
+def rotation_status():
+    state = rotation.status()
+    if state is None:
+        return jsonify({"error": "No key rotation has been started"}), 404
+    return jsonify({"rotation": state})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    metrics.STORE_SIZE.set(store.count())
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE_LATEST)
+
+@app.route('/export', methods=['GET'])
+def export():
+    decrypt = request.args.get('decrypt', '').lower() in ('1', 'true', 'yes')
+    return Response(stream_with_context(_ndjson(export_secrets(decrypt))),
+                    mimetype='application/x-ndjson')
+
+@app.route('/import', methods=['POST'])
+def import_():
+    return Response(stream_with_context(_ndjson(import_secrets(request.stream))),
+                    mimetype='application/x-ndjson')
+
+@app.cli.command('export')
+@click.option('--decrypt', is_flag=True, help='Write plaintext values instead of ciphertext.')
+@click.argument('output', type=click.File('w'), default='-')
+def export_command(decrypt, output):
+    """Write every secret to OUTPUT as NDJSON."""
+    output.writelines(_ndjson(export_secrets(decrypt)))
+
+@app.cli.command('import')
+@click.argument('input', type=click.File('r'), default='-')
+def import_command(input):
+    """Load NDJSON secrets from INPUT, reporting progress on stderr."""
+    for progress in _ndjson(import_secrets(input)):
+        click.echo(progress, nl=False, err=True)
+
 if __name__ == '__main__':
     app.run(debug=True)
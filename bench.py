@@ -0,0 +1,340 @@
+"""Benchmark and load test for the secret API.
+
+Seeds a store with --size secrets, then drives POST /secret, GET
+/secret/<name> and DELETE /secret/<name> from --concurrency threads with the
+requested read/write/delete mix, and reports throughput and p50/p95/p99
+latency as JSON. --check-lost-updates instead has concurrent writers
+update disjoint names and verifies that every final value survived.
+
+Targets:
+  (default)       the Flask test client, in this process, on a fresh data dir
+  --serve N       gunicorn with N workers, started on a fresh data dir
+  --url URL       an already running server
+
+Examples:
+  python bench.py --size 100000 --requests 20000 --concurrency 8
+  python bench.py --serve 4 --storage sqlite --output results.json
+  python bench.py --serve 4 --storage file --check-lost-updates
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode, urlsplit
+
+
+class TestClientTarget:
+    def __init__(self, app_module):
+        self.app = app_module
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.app.test_client()
+        return client
+
+    def request(self, method, path, form=None):
+        response = self._client().open(path, method=method, data=form)
+        return response.status_code, response.get_data()
+
+    def seed(self, lines):
+        progress = None
+        for progress in self.app.import_secrets(lines):
+            pass
+        return progress
+
+
+class HttpTarget:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return conn
+
+    def request(self, method, path, form=None):
+        body = urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form else {}
+        conn = self._conn()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+
+    def seed(self, lines):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=600)
+        body = (line.encode() for line in lines)
+        conn.request('POST', '/import', body=body, encode_chunked=True,
+                     headers={'Content-Type': 'application/x-ndjson'})
+        progress = None
+        for line in conn.getresponse():
+            progress = json.loads(line)
+        conn.close()
+        return progress
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, env):
+    port = _free_port()
+    root = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f"127.0.0.1:{port}",
+         '--chdir', root, 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit('gunicorn exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit('gunicorn did not start listening in time')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(latencies[-1] if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def seed_store(target, prefix, size):
+    lines = (json.dumps({"name": f"{prefix}{i:08d}", "value": f"seed-{i}"}) + '\n'
+             for i in range(size))
+    start = time.perf_counter()
+    progress = target.seed(lines)
+    return {"secrets": size, "seconds": round(time.perf_counter() - start, 3),
+            "progress": progress}
+
+
+def run_load(target, args):
+    ops = ('read', 'write', 'delete')
+    weights = (args.read, args.write, args.delete)
+    latencies = {op: [] for op in ops}
+    statuses = {op: {} for op in ops}
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def worker(worker_id):
+        rng = random.Random(args.seed * 1000 + worker_id)
+        local = {op: [] for op in ops}
+        local_status = {op: {} for op in ops}
+        for _ in counter:
+            op = rng.choices(ops, weights)[0]
+            name = f"{args.prefix}{rng.randrange(args.size):08d}"
+            path = f"/secret/{quote(name, safe='/')}"
+            start = time.perf_counter()
+            try:
+                if op == 'read':
+                    status, _ = target.request('GET', path)
+                elif op == 'write':
+                    status, _ = target.request('POST', '/secret',
+                                               {'name': name, 'value': f"w{rng.random()}"})
+                else:
+                    status, _ = target.request('DELETE', path)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            local[op].append(time.perf_counter() - start)
+            local_status[op][status] = local_status[op].get(status, 0) + 1
+        with lock:
+            for op in ops:
+                latencies[op].extend(local[op])
+                for status, n in local_status[op].items():
+                    statuses[op][str(status)] = statuses[op].get(str(status), 0) + n
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    results = {"seconds": round(elapsed, 3),
+               "overall": summarize([x for op in ops for x in latencies[op]], elapsed),
+               "errors": len(errors), "error_samples": errors[:5]}
+    for op in ops:
+        results[op] = dict(summarize(latencies[op], elapsed), statuses=statuses[op])
+    return results
+
+
+def check_lost_updates(target, args):
+    # Every writer owns its own names, so the last value each writer wrote
+    # must be the one that survives; anything else is a lost update
+    names_per_writer = args.lost_names
+    rounds = args.lost_rounds
+    failures = []
+    lock = threading.Lock()
+
+    def writer(w):
+        for r in range(rounds):
+            for i in range(names_per_writer):
+                name = f"{args.prefix}lost/{w}/{i}"
+                try:
+                    status, _ = target.request('POST', '/secret', {'name': name, 'value': f"{w}:{i}:{r}"})
+                except Exception as e:
+                    status = repr(e)
+                if status != 200:
+                    with lock:
+                        failures.append({"name": name, "round": r, "status": status})
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lost = []
+    for w in range(args.concurrency):
+        for i in range(names_per_writer):
+            name = f"{args.prefix}lost/{w}/{i}"
+            expected = f"{w}:{i}:{rounds - 1}"
+            status, body = target.request('GET', f"/secret/{quote(name, safe='/')}")
+            actual = json.loads(body).get('secret') if status == 200 else None
+            if actual != expected:
+                lost.append({"name": name, "expected": expected, "actual": actual})
+    return {"writers": args.concurrency, "names_per_writer": names_per_writer,
+            "rounds": rounds, "writes": args.concurrency * names_per_writer * rounds,
+            "seconds": round(elapsed, 3), "failed_writes": len(failures),
+            "lost_updates": len(lost), "lost_samples": lost[:10], "ok": not lost and not failures}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='benchmark an already running server')
+    target.add_argument('--serve', type=int, metavar='WORKERS',
+                        help='start gunicorn with this many workers on a fresh data dir')
+    parser.add_argument('--storage', default='file', choices=('file', 'log', 'sqlite'),
+                        help='SECRETS_STORAGE for the test client or --serve (default: file)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra app configuration for the test client or --serve')
+    parser.add_argument('--size', type=int, default=1000, help='secrets to seed (default: 1000)')
+    parser.add_argument('--requests', type=int, default=10000, help='operations to run (default: 10000)')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads (default: 4)')
+    parser.add_argument('--read', type=float, default=0.8, help='share of reads (default: 0.8)')
+    parser.add_argument('--write', type=float, default=0.15, help='share of writes (default: 0.15)')
+    parser.add_argument('--delete', type=float, default=0.05, help='share of deletes (default: 0.05)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--prefix', default='bench/', help='name prefix for benchmark secrets')
+    parser.add_argument('--check-lost-updates', action='store_true',
+                        help='check for lost updates under concurrent writers instead of a load test')
+    parser.add_argument('--lost-names', type=int, default=50, help='names per writer (default: 50)')
+    parser.add_argument('--lost-rounds', type=int, default=5, help='updates per name (default: 5)')
+    parser.add_argument('--output', help='write the JSON results here as well as to stdout')
+    args = parser.parse_args(argv)
+
+    data_dir = None
+    env = dict(os.environ, SECRETS_STORAGE=args.storage)
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    if not args.url:
+        data_dir = tempfile.mkdtemp(prefix='secrets-bench-')
+        env.update(SECRETS_FILE=os.path.join(data_dir, 'secrets.db'),
+                   SQLITE_FILE=os.path.join(data_dir, 'secrets.sqlite3'),
+                   KEY_FILE=os.path.join(data_dir, 'secret.key'))
+
+    server = None
+    if args.url:
+        target, target_name = HttpTarget(args.url), args.url
+    elif args.serve:
+        if 'PROMETHEUS_MULTIPROC_DIR' not in env:
+            env['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(data_dir, 'metrics')
+            os.mkdir(env['PROMETHEUS_MULTIPROC_DIR'])
+        server, url = start_server(args.serve, env)
+        target, target_name = HttpTarget(url), f"gunicorn x{args.serve}"
+    else:
+        os.environ.update(env)
+        import app
+        target, target_name = TestClientTarget(app), 'flask test client'
+
+    results = {
+        "target": target_name,
+        "storage": None if args.url else args.storage,
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "commit": _git_commit()},
+        "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    try:
+        if args.check_lost_updates:
+            results["lost_updates"] = check_lost_updates(target, args)
+        else:
+            results["seed"] = seed_store(target, args.prefix, args.size)
+            results["load"] = run_load(target, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.check_lost_updates and not results["lost_updates"]["ok"]:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class DecryptCache:
+    """Size-bounded LRU cache of decrypted values with a TTL.
+
+    Entries are keyed by name and remember the ciphertext they were decrypted
+    from, so a value rewritten by another worker is a miss rather than a
+    stale hit.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name, ciphertext):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != ciphertext or entry[2] <= time.monotonic():
+                return None
+            self._entries.move_to_end(name)
+            return entry[1]
+
+    def put(self, name, ciphertext, plaintext):
+        """Cache a value and return how many entries were evicted for it."""
+        with self._lock:
+            self._entries[name] = (ciphertext, plaintext, time.monotonic() + self.ttl)
+            self._entries.move_to_end(name)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def invalidate(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
@@ -0,0 +1,14 @@
+# Fernet helpers that batch pools run on their workers. They live outside
+# app.py so that a pool process started with spawn only imports this module,
+# not the app with its store, key file and migration.
+
+
+def encrypt(f, value):
+    return f.encrypt(value.encode()).decode()
+
+
+def decrypt(f, enc):
+    try:
+        return f.decrypt(enc.encode()).decode()
+    except Exception:
+        return None
@@ -0,0 +1,6 @@
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauge samples from /metrics
+    multiprocess.mark_process_dead(worker.pid)
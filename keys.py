@@ -0,0 +1,185 @@
+import base64
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+from store import BackgroundThread, file_lock, file_signature
+
+# urlsafe base64 as Fernet writes it; the decoder would silently skip
+# anything else, including the ':' and line breaks the stores split on
+TOKEN_RE = re.compile(r'[A-Za-z0-9_-]+={0,2}')
+
+
+def token_timestamp(token):
+    """When a Fernet token was created, or None if it is malformed.
+
+    Read straight from the token header without checking the HMAC, so no
+    key is needed; 12 base64 characters cover the version byte and the
+    8-byte big-endian timestamp.
+    """
+    try:
+        header = base64.urlsafe_b64decode(token[:12])
+    except ValueError:
+        return None
+    if len(header) < 9 or header[0] != 0x80:
+        return None
+    return int.from_bytes(header[1:9], 'big')
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Keyring:
+    """Fernet keys stored one per line in ``path``, newest first.
+
+    The newest key encrypts; every key in the file can decrypt. The file is
+    re-read whenever it changes, so a rotation done by one worker is picked
+    up by the others on their next request.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fernet = None
+        self._fernets = []
+        self._sig = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return f.read().split(), file_signature(os.fstat(f.fileno()))
+
+    def _write(self, keys):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(b'\n'.join(keys) + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def fernet(self):
+        with self._lock:
+            try:
+                sig = file_signature(os.stat(self.path))
+            except FileNotFoundError:
+                with file_lock(self.path):
+                    if not os.path.exists(self.path):
+                        self._write([Fernet.generate_key()])
+                sig = None
+            if sig != self._sig or self._fernet is None:
+                keys, self._sig = self._read()
+                self._fernets = [Fernet(k) for k in keys]
+                self._fernet = MultiFernet(self._fernets)
+            return self._fernet
+
+    def verify(self, token):
+        """Whether ``token`` is a well-formed Fernet token signed by one of the keys."""
+        if not TOKEN_RE.fullmatch(token):
+            return False
+        self.fernet()
+        for f in self._fernets:
+            try:
+                f.extract_timestamp(token)
+                return True
+            except InvalidToken:
+                pass
+        return False
+
+    def rotate(self):
+        with self._lock, file_lock(self.path):
+            keys, _ = self._read()
+            self._write([Fernet.generate_key()] + keys)
+            self._sig = None
+
+
+class Reencryptor:
+    """Re-encrypts every stored secret with the newest key after a rotation.
+
+    Progress is kept in ``state_path`` so that a restarted worker resumes
+    from the last finished chunk. Every worker runs a polling thread, but a
+    flock lets only one of them work at a time. Chunks of ``chunk`` secrets
+    are paced to at most ``rate`` secrets per second, and a secret changed
+    since it was read is left alone rather than overwritten.
+    """
+
+    def __init__(self, keyring, store, state_path, chunk=100, rate=500.0, poll=5.0):
+        self.keyring = keyring
+        self.store = store
+        self.state_path = state_path
+        self.chunk = chunk
+        self.rate = rate
+        self.poll = poll
+        self._wake = threading.Event()
+        self._thread = BackgroundThread(self._run, 'secrets-reencrypt')
+
+    def status(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def begin(self):
+        state = {"total": self.store.count(), "done": 0, "cursor": None,
+                 "complete": False, "started_at": time.time(), "finished_at": None}
+        _write_json(self.state_path, state)
+        self.ensure_running()
+        self._wake.set()
+        return state
+
+    def ensure_running(self):
+        self._thread.ensure_running()
+
+    def _run(self):
+        while True:
+            state = self.status()
+            if state is not None and not state['complete']:
+                with open(self.state_path + '.lock', 'a') as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        pass
+                    else:
+                        try:
+                            self._reencrypt()
+                        finally:
+                            fcntl.flock(lock, fcntl.LOCK_UN)
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    def _reencrypt(self):
+        # Re-read under the lock: another worker may have finished meanwhile
+        state = self.status()
+        if state is None or state['complete']:
+            return
+        # Page through the store so no chunk holds its locks for long
+        while True:
+            rows = self.store.scan('', state['cursor'], self.chunk)
+            if not rows:
+                break
+            f = self.keyring.fernet()
+            changes = []
+            for name, enc in rows:
+                try:
+                    changes.append((name, enc, f.rotate(enc.encode()).decode()))
+                except InvalidToken:
+                    # Not readable with any known key; nothing to rotate
+                    pass
+            self.store.replace_many(changes)
+            state['cursor'] = rows[-1][0]
+            state['done'] += len(rows)
+            _write_json(self.state_path, state)
+            time.sleep(len(rows) / self.rate)
+        state['complete'] = True
+        state['finished_at'] = time.time()
+        _write_json(self.state_path, state)
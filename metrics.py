@@ -0,0 +1,102 @@
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                               Gauge, Histogram, generate_latest, multiprocess)
+
+# With PROMETHEUS_MULTIPROC_DIR set, prometheus_client keeps every worker's
+# samples in mmap'd files in that directory and /metrics aggregates them, so
+# any gunicorn worker can answer a scrape for the whole server.
+
+# Most operations finish well under a millisecond, so the default buckets
+# (starting at 5ms) would put nearly everything in the first one
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUESTS = Counter('secrets_http_requests_total', 'HTTP requests handled',
+                   ['method', 'route', 'status'])
+REQUEST_SECONDS = Histogram('secrets_http_request_duration_seconds',
+                            'Time spent handling HTTP requests',
+                            ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+STORE_SECONDS = Histogram('secrets_store_operation_duration_seconds',
+                          'Time spent in secret store operations', ['op'],
+                          buckets=LATENCY_BUCKETS)
+CRYPTO_SECONDS = Histogram('secrets_crypto_duration_seconds',
+                           'Time spent encrypting or decrypting a batch of values', ['op'],
+                           buckets=LATENCY_BUCKETS)
+CRYPTO_VALUES = Counter('secrets_crypto_values_total',
+                        'Values encrypted or decrypted', ['op'])
+CACHE_LOOKUPS = Counter('secrets_decrypt_cache_lookups_total',
+                        'Decrypted value cache lookups', ['result'])
+CACHE_EVICTIONS = Counter('secrets_decrypt_cache_evictions_total',
+                          'Entries evicted from the decrypted value cache')
+STORE_SIZE = Gauge('secrets_store_size', 'Number of stored secrets',
+                   multiprocess_mode='mostrecent')
+
+# Store methods worth timing; anything else is passed through untouched
+_TIMED_OPS = {'get', 'get_many', 'items', 'iter_items', 'scan', 'count',
+              'put', 'put_many', 'delete', 'replace_many'}
+
+
+class TimedStore:
+    """Wraps a SecretStore and records the duration of each operation."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if name not in _TIMED_OPS:
+            return attr
+        histogram = STORE_SECONDS.labels(name)
+
+        def timed(*args, **kwargs):
+            if name == 'iter_items':
+                return _timed_iter(histogram, attr, args, kwargs)
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, timed)
+        return timed
+
+
+def _timed_iter(histogram, func, args, kwargs):
+    # Only the time spent producing items counts, not what the caller does
+    # between them; it is observed once the iteration finishes or is dropped
+    elapsed = 0.0
+    try:
+        start = time.perf_counter()
+        iterator = iter(func(*args, **kwargs))
+        while True:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+            start = time.perf_counter()
+    finally:
+        histogram.observe(elapsed)
+
+
+def render():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry)
+    hits = registry.get_sample_value('secrets_decrypt_cache_lookups_total', {'result': 'hit'}) or 0
+    misses = registry.get_sample_value('secrets_decrypt_cache_lookups_total', {'result': 'miss'}) or 0
+    if hits + misses:
+        output += (
+            b'# HELP secrets_decrypt_cache_hit_ratio Share of cache lookups that were hits\n'
+            b'# TYPE secrets_decrypt_cache_hit_ratio gauge\n'
+            + f"secrets_decrypt_cache_hit_ratio {hits / (hits + misses)}\n".encode()
+        )
+    return output
@@ -0,0 +1,701 @@
+from abc import ABC, abstractmethod
+import fcntl
+from bisect import bisect_left, bisect_right
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Both stores use the original secrets.db line format, "name:ciphertext".
+# A record with an empty ciphertext ("name:") is a tombstone, so a log
+# written by LogStore can still be read by FileStore and vice versa.
+
+
+def _parse_line(line):
+    parts = line.rstrip('\r\n').split(':', 1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return None
+
+
+def _record(name, value):
+    # Nothing is escaped, so refuse anything that would split or merge records
+    if any(c in name for c in ':\r\n') or any(c in value for c in '\r\n'):
+        raise ValueError(f"Cannot store {name!r} as a name:value record")
+    return f"{name}:{value}\n"
+
+
+def _prefix_end(prefix):
+    # Smallest string greater than every string starting with prefix
+    prefix = prefix.rstrip(chr(0x10ffff))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _insort_name(names, name):
+    i = bisect_left(names, name)
+    if i == len(names) or names[i] != name:
+        names.insert(i, name)
+
+
+def _remove_name(names, name):
+    i = bisect_left(names, name)
+    if i < len(names) and names[i] == name:
+        del names[i]
+
+
+def _scan_sorted(names, prefix, after, limit):
+    start = bisect_left(names, prefix)
+    if after is not None:
+        start = max(start, bisect_right(names, after))
+    end = _prefix_end(prefix)
+    stop = bisect_left(names, end) if end is not None else len(names)
+    return names[start:min(stop, start + limit)]
+
+
+def file_signature(st):
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _read_generation(path):
+    try:
+        with open(path + '.gen') as f:
+            return int(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _bump_generation(path):
+    # Called under file_lock after every rename over path. os.replace tends
+    # to alternate between two inodes, so a same-size rewrite may otherwise
+    # only differ in an mtime that coarse filesystems don't resolve.
+    generation = _read_generation(path) + 1
+    tmp = f"{path}.gen.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(str(generation))
+    os.replace(tmp, path + '.gen')
+    return generation
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def file_lock(path):
+    # Serialises writers across gunicorn workers
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class BackgroundThread:
+    """A daemon thread running ``target``, started on demand in each process.
+
+    Threads do not survive a fork, so each gunicorn worker starts its own
+    the first time it calls ensure_running().
+    """
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._pid = None
+
+    def ensure_running(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self.target, daemon=True, name=self.name)
+        self._thread.start()
+
+
+def _write_atomic(path, items):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w') as f:
+            for k, v in items:
+                f.write(_record(k, v))
+            f.flush()
+            os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return st
+
+
+class SecretStore(ABC):
+    """Persistence interface used by app.py. Values are Fernet ciphertexts."""
+
+    @abstractmethod
+    def get(self, name):
+        raise NotImplementedError
+
+    def get_many(self, names):
+        """Return a dict of the ``names`` that exist, read in one pass."""
+        return {name: value for name in names
+                if (value := self.get(name)) is not None}
+
+    @abstractmethod
+    def items(self):
+        raise NotImplementedError
+
+    def count(self):
+        return len(self.items())
+
+    def iter_items(self):
+        """Iterate over ``(name, value)`` pairs without building a new list
+        where the backend allows it."""
+        return iter(self.items())
+
+    def scan(self, prefix='', after=None, limit=100):
+        """Return up to ``limit`` ``(name, value)`` pairs in name order whose
+        name starts with ``prefix`` and sorts after ``after``."""
+        names = sorted(name for name, _ in self.items() if name.startswith(prefix))
+        found = self.get_many(_scan_sorted(names, prefix, after, limit))
+        return list(found.items())
+
+    @abstractmethod
+    def put(self, name, value):
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """Store several ``(name, value)`` pairs with a single write."""
+        for name, value in items:
+            self.put(name, value)
+
+    @abstractmethod
+    def delete(self, name):
+        """Remove ``name``; return False if it did not exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace_many(self, changes):
+        """Apply ``(name, old, new)`` changes whose current value is still ``old``."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileStore(SecretStore):
+    """Rewrites the whole file on every change.
+
+    Each worker keeps the file in memory and only re-reads it when the
+    generation counter in ``<path>.gen`` or the file's inode/size/mtime
+    signature changes, i.e. when another worker saved it.
+    A sorted list of names is built on the first scan() after a reload and
+    then kept up to date by this worker's own writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = {}
+        self._names = None
+        self._sig = None
+        self._lock = threading.RLock()
+
+    def _refresh(self):
+        # Read the generation before the file: a save landing in between
+        # then costs an extra reload instead of going unnoticed
+        generation = _read_generation(self.path)
+        try:
+            sig = (generation,) + file_signature(os.stat(self.path))
+        except FileNotFoundError:
+            self._index, self._names, self._sig = {}, None, None
+            return
+        if sig == self._sig:
+            return
+        secrets = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    rec = _parse_line(line)
+                    if rec is None:
+                        continue
+                    if rec[1]:
+                        secrets[rec[0]] = rec[1]
+                    else:
+                        secrets.pop(rec[0], None)
+                sig = (generation,) + file_signature(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            secrets, sig = {}, None
+        self._index, self._names, self._sig = secrets, None, sig
+
+    def _save(self, secrets):
+        st = _write_atomic(self.path, secrets.items())
+        generation = _bump_generation(self.path)
+        self._index, self._sig = secrets, (generation,) + file_signature(st)
+
+    def get(self, name):
+        with self._lock:
+            self._refresh()
+            return self._index.get(name)
+
+    def get_many(self, names):
+        with self._lock:
+            self._refresh()
+            index = self._index
+        return {name: index[name] for name in names if name in index}
+
+    def items(self):
+        with self._lock:
+            self._refresh()
+            return list(self._index.items())
+
+    def iter_items(self):
+        # Saves replace the index rather than mutate it, so iterating the
+        # current one is safe without a copy
+        with self._lock:
+            self._refresh()
+            index = self._index
+        return iter(index.items())
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+    def scan(self, prefix='', after=None, limit=100):
+        with self._lock:
+            self._refresh()
+            if self._names is None:
+                self._names = sorted(self._index)
+            return [(name, self._index[name])
+                    for name in _scan_sorted(self._names, prefix, after, limit)]
+
+    def put(self, name, value):
+        self.put_many([(name, value)])
+
+    def put_many(self, items):
+        items = list(items)
+        with self._lock, file_lock(self.path):
+            self._refresh()
+            secrets = dict(self._index)
+            secrets.update(items)
+            self._save(secrets)
+            if self._names is not None:
+                for name, _ in items:
+                    _insort_name(self._names, name)
+
+    def delete(self, name):
+        with self._lock, file_lock(self.path):
+            self._refresh()
+            if name not in self._index:
+                return False
+            secrets = dict(self._index)
+            del secrets[name]
+            self._save(secrets)
+            if self._names is not None:
+                _remove_name(self._names, name)
+            return True
+
+    def replace_many(self, changes):
+        with self._lock, file_lock(self.path):
+            self._refresh()
+            secrets = dict(self._index)
+            applied = 0
+            for name, old, new in changes:
+                if secrets.get(name) == old:
+                    secrets[name] = new
+                    applied += 1
+            if applied:
+                self._save(secrets)
+            return applied
+
+
+class LogStore(SecretStore):
+    """Appends puts and tombstones to the file instead of rewriting it.
+
+    Workers tail the log from the last offset they read, so refreshing costs
+    an fstat plus whatever other workers appended. Appends are fsynced in
+    batches of ``fsync_batch`` records or every ``fsync_interval`` seconds.
+    Once at least ``compact_min`` records exist and the share of dead ones
+    reaches ``compact_ratio``, a background thread rewrites the live set to a
+    temp file and renames it over the log.
+    """
+
+    def __init__(self, path, fsync_batch=32, fsync_interval=0.05,
+                 compact_ratio=0.5, compact_min=1024):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self._index = {}
+        self._names = None
+        self._ino = None
+        self._generation = None
+        self._offset = 0
+        self._records = 0
+        self._fd = None
+        self._fd_ino = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # _lock guards the index; _write_lock orders appends and compaction
+        # so that readers are never blocked while a compaction is running.
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._worker = BackgroundThread(self._background, 'secrets-log')
+        self._stopped = threading.Event()
+
+    def _apply(self, data):
+        for line in data.decode().splitlines():
+            rec = _parse_line(line)
+            if rec is None:
+                continue
+            self._records += 1
+            if rec[1]:
+                self._index[rec[0]] = rec[1]
+                if self._names is not None:
+                    _insort_name(self._names, rec[0])
+            else:
+                self._index.pop(rec[0], None)
+                if self._names is not None:
+                    _remove_name(self._names, rec[0])
+
+    def _refresh(self):
+        generation = _read_generation(self.path)
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._index, self._ino, self._offset, self._records = {}, None, 0, 0
+            self._names, self._generation = None, generation
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            replaced = generation != self._generation or st.st_ino != self._ino
+            if not replaced and st.st_size == self._offset:
+                return
+            if replaced or st.st_size < self._offset:
+                # Compacted or replaced by another worker: start over
+                self._index, self._offset, self._records = {}, 0, 0
+                self._ino, self._names, self._generation = st.st_ino, None, generation
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+            # Leave a partially appended trailing record for the next refresh
+            end = data.rfind(b'\n') + 1
+            self._apply(data[:end])
+            self._offset += end
+
+    def _append(self, records):
+        st = None
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            pass
+        if self._fd is None or st is None or st.st_ino != self._fd_ino:
+            self._close_fd()
+            self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            self._fd_ino = os.fstat(self._fd).st_ino
+        size = self._repair_tail()
+        data = memoryview(''.join(records).encode())
+        try:
+            while data:
+                written = os.write(self._fd, data)
+                if not written:
+                    raise OSError(f"Could not append to {self.path}")
+                data = data[written:]
+        except BaseException:
+            # Do not leave a partial record behind for the next append
+            os.ftruncate(self._fd, size)
+            raise
+        self._unsynced += len(records)
+        if self._unsynced >= self.fsync_batch:
+            self._sync()
+        self._worker.ensure_running()
+
+    def _repair_tail(self):
+        # A crash or failed write in any worker can leave a partial last
+        # record. Cut it off before every append so the next record is not
+        # glued onto it; callers hold file_lock, so no other worker is
+        # appending meanwhile. Returns the size of the repaired file.
+        size = end = os.fstat(self._fd).st_size
+        if not size or os.pread(self._fd, 1, size - 1) == b'\n':
+            return size
+        while end > 0:
+            start = max(0, end - 4096)
+            newline = os.pread(self._fd, end - start, start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        os.ftruncate(self._fd, end)
+        return end
+
+    def _sync(self):
+        if self._fd is not None and self._unsynced:
+            os.fsync(self._fd)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _close_fd(self):
+        if self._fd is not None:
+            self._sync()
+            os.close(self._fd)
+            self._fd = self._fd_ino = None
+
+    def _write(self, records):
+        with self._write_lock, file_lock(self.path):
+            with self._lock:
+                self._refresh()
+                self._append(records)
+                self._refresh()
+
+    def get(self, name):
+        with self._lock:
+            self._refresh()
+            return self._index.get(name)
+
+    def get_many(self, names):
+        with self._lock:
+            self._refresh()
+            return {name: self._index[name] for name in names if name in self._index}
+
+    def items(self):
+        with self._lock:
+            self._refresh()
+            return list(self._index.items())
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+    def iter_items(self, page_size=1000):
+        # Tailing the log updates the index in place, so page through it in
+        # name order instead of copying it
+        after = None
+        while True:
+            rows = self.scan('', after, page_size)
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    def scan(self, prefix='', after=None, limit=100):
+        with self._lock:
+            self._refresh()
+            if self._names is None:
+                self._names = sorted(self._index)
+            return [(name, self._index[name])
+                    for name in _scan_sorted(self._names, prefix, after, limit)]
+
+    def put(self, name, value):
+        self._write([_record(name, value)])
+
+    def put_many(self, items):
+        records = [_record(name, value) for name, value in items]
+        if records:
+            self._write(records)
+
+    def delete(self, name):
+        with self._write_lock, file_lock(self.path):
+            with self._lock:
+                self._refresh()
+                if name not in self._index:
+                    return False
+                self._append([_record(name, '')])
+                self._refresh()
+                return True
+
+    def replace_many(self, changes):
+        with self._write_lock, file_lock(self.path):
+            with self._lock:
+                self._refresh()
+                records = [_record(name, new) for name, old, new in changes
+                           if self._index.get(name) == old]
+                if records:
+                    self._append(records)
+                    self._refresh()
+                return len(records)
+
+    def compact(self):
+        with self._write_lock, file_lock(self.path):
+            with self._lock:
+                self._refresh()
+                live = list(self._index.items())
+                self._sync()
+            # Readers keep using the current index while the new file is written
+            st = _write_atomic(self.path, live)
+            _fsync_dir(self.path)
+            generation = _bump_generation(self.path)
+            with self._lock:
+                self._close_fd()
+                self._ino, self._offset, self._records = st.st_ino, st.st_size, len(live)
+                self._generation = generation
+
+    def _needs_compaction(self):
+        with self._lock:
+            return (self._records >= self.compact_min
+                    and 1 - len(self._index) / self._records >= self.compact_ratio)
+
+    def _background(self):
+        while not self._stopped.wait(self.fsync_interval):
+            with self._write_lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+            if self._needs_compaction():
+                self.compact()
+
+    def close(self):
+        self._stopped.set()
+        with self._write_lock:
+            self._close_fd()
+
+
+class SqliteStore(SecretStore):
+    """Keeps secrets in a SQLite database in WAL mode.
+
+    Each thread reuses its own connection, and sqlite3's statement cache
+    keeps the constant queries below prepared. If the database is empty and
+    ``migrate_from`` names an existing secrets.db file, its contents are
+    imported once on first open.
+    """
+
+    GET = 'SELECT value FROM secrets WHERE name = ?'
+    ITEMS = 'SELECT name, value FROM secrets'
+    COUNT = 'SELECT count(*) FROM secrets'
+    PAGE = 'SELECT name, value FROM secrets WHERE name > ? ORDER BY name LIMIT ?'
+    PUT = ('INSERT INTO secrets (name, value) VALUES (?, ?) '
+           'ON CONFLICT(name) DO UPDATE SET value = excluded.value')
+    DELETE = 'DELETE FROM secrets WHERE name = ?'
+    REPLACE = 'UPDATE secrets SET value = ? WHERE name = ? AND value = ?'
+    SCAN = ('SELECT name, value FROM secrets WHERE name >= ? AND name > ? '
+            'AND name < ? ORDER BY name LIMIT ?')
+    SCAN_ALL = ('SELECT name, value FROM secrets WHERE name >= ? AND name > ? '
+                'ORDER BY name LIMIT ?')
+
+    def __init__(self, path, migrate_from=None, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._setup(migrate_from)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork into gunicorn workers
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, cached_statements=64)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _setup(self, migrate_from):
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS secrets '
+                     '(name TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                     '(key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+        if not migrate_from or not os.path.exists(migrate_from):
+            return
+        # BEGIN IMMEDIATE so that only one worker performs the migration
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from'").fetchone()
+            empty = conn.execute('SELECT 1 FROM secrets LIMIT 1').fetchone() is None
+            if not done and empty:
+                conn.executemany(self.PUT, FileStore(migrate_from).items())
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('migrated_from', ?)",
+                         (os.path.abspath(migrate_from),))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, name):
+        row = self._conn().execute(self.GET, (name,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, names):
+        conn = self._conn()
+        names = list(dict.fromkeys(names))
+        found = {}
+        # Stay under SQLite's default limit on bound parameters
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            sql = f"SELECT name, value FROM secrets WHERE name IN ({','.join('?' * len(chunk))})"
+            found.update(conn.execute(sql, chunk).fetchall())
+        return found
+
+    def items(self):
+        return self._conn().execute(self.ITEMS).fetchall()
+
+    def count(self):
+        return self._conn().execute(self.COUNT).fetchone()[0]
+
+    def iter_items(self, page_size=1000):
+        # Walk the primary key a page at a time instead of holding one read
+        # transaction open for the whole iteration
+        after = ''
+        while True:
+            rows = self._conn().execute(self.PAGE, (after, page_size)).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    def scan(self, prefix='', after=None, limit=100):
+        after = '' if after is None else after
+        end = _prefix_end(prefix)
+        if end is None:
+            return self._conn().execute(self.SCAN_ALL, (prefix, after, limit)).fetchall()
+        return self._conn().execute(self.SCAN, (prefix, after, end, limit)).fetchall()
+
+    def put(self, name, value):
+        self._conn().execute(self.PUT, (name, value))
+
+    def put_many(self, items):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(self.PUT, items)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, name):
+        return self._conn().execute(self.DELETE, (name,)).rowcount > 0
+
+    def replace_many(self, changes):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            applied = sum(conn.execute(self.REPLACE, (new, name, old)).rowcount
+                          for name, old, new in changes)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return applied
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_store(kind, path, **options):
+    if kind == 'file':
+        return FileStore(path)
+    if kind == 'log':
+        return LogStore(path, **options)
+    if kind == 'sqlite':
+        return SqliteStore(path, **options)
+    raise ValueError(f"Unknown storage kind: {kind}")
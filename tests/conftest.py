@@ -0,0 +1,38 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_env():
+    """Extra configuration for app_module; override it to change settings."""
+    return {}
+
+
+@pytest.fixture(params=['file', 'log', 'sqlite'])
+def app_module(request, tmp_path, monkeypatch, app_env):
+    # app.py reads its configuration at import time, so import a fresh copy
+    # pointed at an empty data directory for every test
+    monkeypatch.setenv('SECRETS_STORAGE', request.param)
+    monkeypatch.setenv('SECRETS_FILE', str(tmp_path / 'secrets.db'))
+    monkeypatch.setenv('SQLITE_FILE', str(tmp_path / 'secrets.sqlite3'))
+    monkeypatch.setenv('KEY_FILE', str(tmp_path / 'secret.key'))
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    for name, value in app_env.items():
+        monkeypatch.setenv(name, value)
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    yield module
+    if module._pool is not None:
+        module._pool.shutdown()
+    module.store.close()
+    sys.modules.pop('app', None)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
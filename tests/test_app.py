@@ -0,0 +1,123 @@
+import json
+import time
+
+import pytest
+from cryptography.fernet import Fernet
+
+
+def _reloaded(app_module):
+    # A fresh store instance reads what is actually on disk
+    return type(app_module.store._store)(app_module.store._store.path)
+
+
+@pytest.mark.parametrize('name', ['a:b', 'x\nvictim:', 'x\rvictim'])
+def test_add_secret_rejects_names_that_break_records(client, name):
+    response = client.post('/secret', data={'name': name, 'value': 'v'})
+    assert response.status_code == 400
+
+
+def test_batch_reports_bad_names_per_item(app_module, client):
+    client.post('/secret', data={'name': 'victim', 'value': 'safe'})
+    response = client.post('/secrets/batch', json={'secrets': [
+        {'name': 'x\nvictim:', 'value': 'v'},
+        {'name': 'a:b', 'value': 'v'},
+        {'name': 'ok', 'value': 'v'},
+    ]})
+    results = response.get_json()['results']
+    assert [r.get('status') for r in results] == [None, None, 'success']
+    assert all('error' in r for r in results[:2])
+    assert sorted(name for name, _ in _reloaded(app_module).items()) == ['ok', 'victim']
+    assert client.get('/secret/victim').get_json() == {'secret': 'safe'}
+
+
+def test_batch_rejects_non_object_body(client):
+    response = client.post('/secrets/batch', json=[{'name': 'a', 'value': 'v'}])
+    assert response.status_code == 400
+
+
+def test_import_reports_bad_names_per_line(app_module, client):
+    body = b'{"name": "x\\nvictim:", "value": "v"}\n{"name": "ok", "value": "v"}\n'
+    lines = client.post('/import', data=body).get_data(as_text=True).splitlines()
+    assert lines[0] == '{"line": 1, "error": "Name must not contain \':\' or line breaks"}'
+    assert lines[-1] == '{"imported": 1, "errors": 1}'
+    assert [name for name, _ in _reloaded(app_module).items()] == ['ok']
+
+
+def test_import_rejects_malformed_ciphertext(app_module, client):
+    client.post('/secret', data={'name': 'b', 'value': 'safe'})
+    token = app_module.keyring.fernet().encrypt(b'v').decode()
+    foreign = Fernet(Fernet.generate_key()).encrypt(b'v').decode()
+    body = '\n'.join(json.dumps(line) for line in [
+        {'name': 'n1', 'ciphertext': 'garbage\nb:'},
+        {'name': 'n2', 'ciphertext': token + '\nb:'},
+        {'name': 'n3', 'ciphertext': foreign},
+        {'name': 'n4', 'ciphertext': token},
+    ])
+    lines = client.post('/import', data=body).get_data(as_text=True).splitlines()
+    assert [json.loads(line).get('line') for line in lines[:-1]] == [1, 2, 3]
+    assert lines[-1] == '{"imported": 1, "errors": 3}'
+    assert sorted(name for name, _ in _reloaded(app_module).items()) == ['b', 'n4']
+    assert client.get('/secret/b').get_json() == {'secret': 'safe'}
+    assert client.get('/secret/n4').get_json() == {'secret': 'v'}
+
+
+def test_list_secrets_pages_with_next_cursor(client):
+    before = int(time.time())
+    names = [f"app/{i}" for i in range(5)] + ['other']
+    client.post('/secrets/batch', json={'secrets': [{'name': n, 'value': 'v'} for n in names]})
+
+    page = client.get('/secrets?prefix=app/&limit=2').get_json()
+    assert [s['name'] for s in page['secrets']] == ['app/0', 'app/1']
+    assert all(before <= s['encrypted_at'] <= time.time() for s in page['secrets'])
+    assert page['next_cursor'] == 'app/1'
+
+    seen = [s['name'] for s in page['secrets']]
+    while page['next_cursor']:
+        page = client.get(f"/secrets?prefix=app/&limit=2&cursor={page['next_cursor']}").get_json()
+        seen += [s['name'] for s in page['secrets']]
+    assert seen == names[:5]
+
+
+@pytest.mark.parametrize('decrypt', ['', '?decrypt=1'])
+def test_export_then_import_restores_every_secret(app_module, client, decrypt):
+    secrets = {f"app/{i}": f"value {i}" for i in range(5)}
+    client.post('/secrets/batch', json={'secrets': [{'name': n, 'value': v} for n, v in secrets.items()]})
+
+    exported = client.get(f"/export{decrypt}").get_data()
+    lines = [json.loads(line) for line in exported.splitlines()]
+    assert sorted(line['name'] for line in lines) == sorted(secrets)
+    assert all(('value' in line) == bool(decrypt) for line in lines)
+    for name in secrets:
+        client.delete(f"/secret/{name}")
+
+    progress = client.post('/import', data=exported).get_data(as_text=True).splitlines()
+    assert json.loads(progress[-1]) == {"imported": 5, "errors": 0}
+    for name, value in secrets.items():
+        assert client.get(f"/secret/{name}").get_json() == {'secret': value}
+
+
+def test_batch_get_reports_missing_and_undecryptable_per_item(app_module, client):
+    client.post('/secret', data={'name': 'a', 'value': 'A'})
+    app_module.store.put('foreign', Fernet(Fernet.generate_key()).encrypt(b'x').decode())
+
+    response = client.get('/secrets/batch?name=a&name=missing&name=foreign')
+    assert response.get_json() == {'results': [
+        {'name': 'a', 'secret': 'A'},
+        {'name': 'missing', 'error': 'Secret not found'},
+        {'name': 'foreign', 'error': 'Decryption failed'},
+    ]}
+    assert client.get('/secrets/batch').status_code == 400
+
+
+@pytest.mark.parametrize('app_env', [
+    {'BATCH_POOL': kind, 'BATCH_POOL_MIN': '1', 'BATCH_POOL_WORKERS': '2'}
+    for kind in ('thread', 'process')
+], ids=['thread', 'process'])
+def test_batch_runs_crypto_on_the_pool(app_module, client):
+    names = [f"n{i}" for i in range(10)]
+    client.post('/secrets/batch', json={'secrets': [{'name': n, 'value': n.upper()} for n in names]})
+    assert app_module._pool is not None
+
+    query = '&'.join(f"name={n}" for n in names)
+    results = client.get(f"/secrets/batch?{query}").get_json()['results']
+    assert results == [{'name': n, 'secret': n.upper()} for n in names]
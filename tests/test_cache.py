@@ -0,0 +1,63 @@
+import pytest
+
+import cache
+from cache import DecryptCache
+
+
+@pytest.fixture
+def app_env():
+    return {'DECRYPT_CACHE_SIZE': '2', 'DECRYPT_CACHE_TTL': '60'}
+
+
+def test_evicts_least_recently_used_first():
+    c = DecryptCache(2, 60)
+    assert c.put('a', 'A', 'a') == 0
+    assert c.put('b', 'B', 'b') == 0
+    assert c.get('a', 'A') == 'a'
+    assert c.put('c', 'C', 'c') == 1
+
+    assert c.get('b', 'B') is None
+    assert c.get('a', 'A') == 'a'
+    assert c.get('c', 'C') == 'c'
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    c = DecryptCache(10, 5)
+    c.put('a', 'A', 'a')
+    now[0] = 104.9
+    assert c.get('a', 'A') == 'a'
+    now[0] = 105.0
+    assert c.get('a', 'A') is None
+
+
+def test_changed_ciphertext_is_a_miss():
+    c = DecryptCache(10, 60)
+    c.put('a', 'A1', 'old')
+    assert c.get('a', 'A2') is None
+    c.invalidate('a')
+    assert c.get('a', 'A1') is None
+
+
+def test_app_serves_the_value_written_by_another_worker(app_module, client):
+    client.post('/secret', data={'name': 'a', 'value': 'one'})
+    assert client.get('/secret/a').get_json() == {'secret': 'one'}
+    # Bypasses this worker's cache invalidation, as another worker's write would
+    app_module.store.put('a', app_module.keyring.fernet().encrypt(b'two').decode())
+    assert client.get('/secret/a').get_json() == {'secret': 'two'}
+
+
+@pytest.mark.parametrize('change', [
+    lambda client: client.post('/secret', data={'name': 'a', 'value': 'two'}),
+    lambda client: client.post('/secrets/batch', json={'secrets': [{'name': 'a', 'value': 'two'}]}),
+    lambda client: client.delete('/secret/a'),
+], ids=['post', 'batch', 'delete'])
+def test_app_forgets_cached_values_it_changes(app_module, client, change):
+    client.post('/secret', data={'name': 'a', 'value': 'one'})
+    enc = app_module.store.get('a')
+    client.get('/secret/a')
+    assert app_module.cache.get('a', enc) == 'one'
+
+    change(client)
+    assert app_module.cache.get('a', enc) is None
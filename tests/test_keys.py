@@ -0,0 +1,124 @@
+import fcntl
+import json
+import time
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from keys import Keyring, Reencryptor
+from store import FileStore, LogStore, SqliteStore
+
+
+@pytest.fixture
+def keyring(tmp_path):
+    return Keyring(str(tmp_path / 'secret.key'))
+
+
+@pytest.fixture(params=[FileStore, LogStore, SqliteStore])
+def secrets(request, tmp_path):
+    s = request.param(str(tmp_path / 'secrets.db'))
+    yield s
+    s.close()
+
+
+def _key_file(keyring):
+    with open(keyring.path, 'rb') as f:
+        return f.read().split()
+
+
+def _reencryptor(keyring, store, tmp_path, monkeypatch):
+    # Run _reencrypt in the test's thread rather than the polling one
+    monkeypatch.setattr(Reencryptor, 'ensure_running', lambda self: None)
+    return Reencryptor(keyring, store, str(tmp_path / 'rotation'), chunk=2, rate=1e6)
+
+
+def test_rotate_prepends_a_key_and_keeps_old_tokens_readable(keyring):
+    token = keyring.fernet().encrypt(b'v')
+    [old] = _key_file(keyring)
+    keyring.rotate()
+
+    new, kept = _key_file(keyring)
+    assert kept == old
+    assert keyring.fernet().decrypt(token) == b'v'
+    assert Fernet(new).decrypt(keyring.fernet().encrypt(b'w')) == b'w'
+
+
+def test_reencrypt_rotates_every_secret(keyring, secrets, tmp_path, monkeypatch):
+    f = keyring.fernet()
+    secrets.put_many([(f"n{i}", f.encrypt(f"v{i}".encode()).decode()) for i in range(5)])
+    keyring.rotate()
+    new = Fernet(_key_file(keyring)[0])
+    rotation = _reencryptor(keyring, secrets, tmp_path, monkeypatch)
+
+    assert rotation.begin()['total'] == 5
+    rotation._reencrypt()
+
+    assert sorted((name, new.decrypt(enc.encode()).decode()) for name, enc in secrets.items()) == \
+        [(f"n{i}", f"v{i}") for i in range(5)]
+    state = rotation.status()
+    assert state['complete'] and state['done'] == 5 and state['cursor'] == 'n4'
+
+
+def test_reencrypt_leaves_secrets_written_meanwhile_alone(keyring, secrets, tmp_path, monkeypatch):
+    f = keyring.fernet()
+    secrets.put_many([('a', f.encrypt(b'old').decode()), ('b', f.encrypt(b'old').decode())])
+    keyring.rotate()
+    written = keyring.fernet().encrypt(b'new').decode()
+    replace_many = secrets.replace_many
+
+    def write_first(changes):
+        # Another worker writes 'a' between the rotation's read and its swap
+        secrets.put('a', written)
+        return replace_many(changes)
+
+    monkeypatch.setattr(secrets, 'replace_many', write_first)
+    rotation = _reencryptor(keyring, secrets, tmp_path, monkeypatch)
+    rotation.begin()
+    rotation._reencrypt()
+
+    assert secrets.get('a') == written
+    assert Fernet(_key_file(keyring)[0]).decrypt(secrets.get('b').encode()) == b'old'
+
+
+def test_reencrypt_resumes_after_the_saved_cursor(keyring, secrets, tmp_path, monkeypatch):
+    f = keyring.fernet()
+    [old] = _key_file(keyring)
+    secrets.put_many([(name, f.encrypt(name.encode()).decode()) for name in 'abcd'])
+    keyring.rotate()
+    rotation = _reencryptor(keyring, secrets, tmp_path, monkeypatch)
+    rotation.begin()
+    state = dict(rotation.status(), cursor='b', done=2)
+    with open(rotation.state_path, 'w') as out:
+        json.dump(state, out)
+    rotation._reencrypt()
+
+    readable_with_old = set()
+    for name, enc in secrets.items():
+        try:
+            Fernet(old).decrypt(enc.encode())
+            readable_with_old.add(name)
+        except InvalidToken:
+            pass
+    assert readable_with_old == {'a', 'b'}
+    assert rotation.status()['done'] == 4
+
+
+def test_rotate_endpoint_refuses_while_a_rotation_runs(app_module, client):
+    client.post('/secret', data={'name': 'a', 'value': 'v'})
+    rotation = app_module.rotation
+    # Hold the lock the background thread takes, as a busy worker would
+    with open(rotation.state_path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert client.post('/keys/rotate').status_code == 200
+        response = client.post('/keys/rotate')
+        assert response.status_code == 409
+        assert response.get_json()['rotation']['complete'] is False
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    rotation._wake.set()
+    deadline = time.monotonic() + 5
+    while not rotation.status()['complete'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert rotation.status()['complete']
+    assert client.get('/secret/a').get_json() == {'secret': 'v'}
+    assert client.post('/keys/rotate').status_code == 200
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+
+
+class SlowStore:
+    def iter_items(self):
+        for i in range(3):
+            time.sleep(0.02)
+            yield str(i), 'x'
+
+
+def _iter_items_sample(suffix):
+    return REGISTRY.get_sample_value(f"secrets_store_operation_duration_seconds_{suffix}",
+                                     {'op': 'iter_items'}) or 0
+
+
+def test_iter_items_times_the_iteration_not_the_caller():
+    store = metrics.TimedStore(SlowStore())
+    count, total = _iter_items_sample('count'), _iter_items_sample('sum')
+
+    items = store.iter_items()
+    assert _iter_items_sample('count') == count
+    for _ in items:
+        time.sleep(0.1)
+
+    assert _iter_items_sample('count') == count + 1
+    assert 0.06 <= _iter_items_sample('sum') - total < 0.2
+
+
+def _scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    samples = {}
+    for family in text_string_to_metric_families(response.get_data(as_text=True)):
+        for sample in family.samples:
+            samples[sample.name, tuple(sorted(sample.labels.items()))] = sample.value
+    return samples
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def test_metrics_endpoint_reports_requests_and_store_size(client):
+    for name in ('a', 'b', 'c'):
+        client.post('/secret', data={'name': name, 'value': 'v'})
+    client.get('/secret/a')
+    client.open('/secret/a', method='BREW')
+    samples = _scrape(client)
+
+    route = _labels(method='POST', route='/secret', status='200')
+    assert samples['secrets_http_requests_total', route] >= 3
+    assert samples['secrets_http_request_duration_seconds_count', route] >= 3
+    assert ('secrets_http_request_duration_seconds_bucket', _labels(le='+Inf', **dict(route))) in samples
+    assert samples['secrets_http_requests_total',
+                   _labels(method='other', route='unmatched', status='405')] >= 1
+    assert not any(dict(labels).get('method') == 'BREW' for _, labels in samples)
+    assert samples['secrets_store_size', ()] == 3
+    assert samples['secrets_store_operation_duration_seconds_count', _labels(op='put')] >= 3
+
+
+@pytest.mark.parametrize('app_env', [{'DECRYPT_CACHE_SIZE': '10'}])
+def test_metrics_endpoint_reports_cache_hit_ratio(client):
+    client.post('/secret', data={'name': 'a', 'value': 'v'})
+    for _ in range(3):
+        client.get('/secret/a')
+    samples = _scrape(client)
+
+    hits = samples['secrets_decrypt_cache_lookups_total', _labels(result='hit')]
+    misses = samples['secrets_decrypt_cache_lookups_total', _labels(result='miss')]
+    assert hits >= 2
+    assert samples['secrets_decrypt_cache_hit_ratio', ()] == pytest.approx(hits / (hits + misses))
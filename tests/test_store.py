@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+
+import pytest
+
+import store
+from store import FileStore, LogStore, SqliteStore
+
+
+def test_file_store_notices_saves_that_stat_cannot_tell_apart(tmp_path, monkeypatch):
+    # os.replace alternates between inodes and coarse filesystems round
+    # mtimes, so a same-size rewrite can leave stat() unchanged
+    monkeypatch.setattr(store, 'file_signature', lambda st: (0, 0, 0))
+    path = str(tmp_path / 'secrets.db')
+    writer, reader = FileStore(path), FileStore(path)
+    writer.put('a', '1111')
+    assert reader.get('a') == '1111'
+
+    writer.put('a', '2222')
+    assert reader.get('a') == '2222'
+
+    reader.put('b', '3333')
+    assert writer.items() == [('a', '2222'), ('b', '3333')]
+
+
+def _lines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def test_log_store_drops_torn_trailing_record_before_appending(tmp_path):
+    path = str(tmp_path / 'secrets.db')
+    with open(path, 'w') as f:
+        f.write('a:AAA\nb:BBBpartial')
+    log = LogStore(path)
+    assert log.items() == [('a', 'AAA')]
+    log.put('c', 'CCC')
+    log.close()
+
+    assert _lines(path) == ['a:AAA', 'c:CCC']
+    assert sorted(LogStore(path).items()) == [('a', 'AAA'), ('c', 'CCC')]
+
+
+def test_log_store_with_open_fd_drops_torn_record_left_by_another_worker(tmp_path):
+    path = str(tmp_path / 'secrets.db')
+    a, b = LogStore(path), LogStore(path)
+    a.put('a', 'AAA')
+    b.put('z', 'ZZZ')
+    with open(path, 'a') as f:
+        f.write('b:BBBpart')
+    b.put('c', 'CCC')
+    a.put('d', 'DDD')
+
+    assert b.get('c') == 'CCC'
+    assert a.get('b') is None
+    assert _lines(path) == ['a:AAA', 'z:ZZZ', 'c:CCC', 'd:DDD']
+    a.close()
+    b.close()
+
+
+def test_log_store_finishes_short_writes(tmp_path, monkeypatch):
+    path = str(tmp_path / 'secrets.db')
+    log = LogStore(path)
+    write = os.write
+    monkeypatch.setattr(os, 'write', lambda fd, data: write(fd, data[:3]))
+    log.put_many([('a', 'AAAAAA'), ('b', 'BBBBBB')])
+    monkeypatch.undo()
+    log.close()
+
+    assert _lines(path) == ['a:AAAAAA', 'b:BBBBBB']
+
+
+def test_log_store_removes_a_failed_partial_append(tmp_path, monkeypatch):
+    path = str(tmp_path / 'secrets.db')
+    log = LogStore(path)
+    log.put('a', 'AAA')
+    write = os.write
+    calls = []
+
+    def fail_after_first_chunk(fd, data):
+        calls.append(fd)
+        if len(calls) > 1:
+            raise OSError(28, 'No space left on device')
+        return write(fd, data[:4])
+
+    monkeypatch.setattr(os, 'write', fail_after_first_chunk)
+    with pytest.raises(OSError):
+        log.put('b', 'BBBBBB')
+    monkeypatch.undo()
+
+    assert log.get('b') is None
+    assert _lines(path) == ['a:AAA']
+    log.close()
+
+
+def test_log_store_compaction_keeps_live_records(tmp_path):
+    path = str(tmp_path / 'secrets.db')
+    writer, reader = LogStore(path), LogStore(path)
+    for i in range(5):
+        writer.put('a', f"A{i}")
+    writer.put('b', 'B')
+    writer.put('c', 'C')
+    writer.delete('b')
+    assert sorted(reader.items()) == [('a', 'A4'), ('c', 'C')]
+
+    writer.compact()
+    assert sorted(_lines(path)) == ['a:A4', 'c:C']
+    writer.put('d', 'D')
+    assert sorted(reader.items()) == [('a', 'A4'), ('c', 'C'), ('d', 'D')]
+    writer.close()
+
+
+def test_log_store_compacts_in_background(tmp_path):
+    path = str(tmp_path / 'secrets.db')
+    log = LogStore(path, fsync_interval=0.01, compact_ratio=0.5, compact_min=8)
+    for i in range(20):
+        log.put('a', str(i))
+    deadline = time.monotonic() + 5
+    while len(_lines(path)) > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _lines(path) == ['a:19']
+    assert log.get('a') == '19'
+    log.close()
+
+
+def test_sqlite_store_migrates_secrets_db_once(tmp_path):
+    legacy = str(tmp_path / 'secrets.db')
+    db = str(tmp_path / 'secrets.sqlite3')
+    with open(legacy, 'w') as f:
+        f.write('a:AAA\nb:BBB\nb:\nc:CCC\n')
+
+    store = SqliteStore(db, migrate_from=legacy)
+    assert sorted(store.items()) == [('a', 'AAA'), ('c', 'CCC')]
+    store.delete('a')
+    store.close()
+
+    # Reopening must not import secrets.db again
+    with open(legacy, 'a') as f:
+        f.write('d:DDD\n')
+    store = SqliteStore(db, migrate_from=legacy)
+    assert store.items() == [('c', 'CCC')]
+    store.close()
+
+
+def test_sqlite_store_without_legacy_file_starts_empty(tmp_path):
+    store = SqliteStore(str(tmp_path / 'secrets.sqlite3'),
+                        migrate_from=str(tmp_path / 'missing.db'))
+    assert store.items() == []
+    store.put('a', 'AAA')
+    assert store.get('a') == 'AAA'
+    store.close()
+
+
+@pytest.mark.parametrize('kind', [FileStore, LogStore, SqliteStore])
+def test_scan_pages_through_a_prefix_in_name_order(tmp_path, kind):
+    path = str(tmp_path / 'secrets.db')
+    s = kind(path)
+    s.put_many([('app/b', '2'), ('app/a', '1'), ('other', 'x'), ('app/c', '3'),
+                ('app0', 'y'), ('app/d', '4')])
+    s.delete('app/c')
+
+    assert s.scan('app/', limit=2) == [('app/a', '1'), ('app/b', '2')]
+    assert s.scan('app/', after='app/b', limit=2) == [('app/d', '4')]
+    assert s.scan('app/', after='app/d', limit=2) == []
+    assert [name for name, _ in s.scan()] == ['app/a', 'app/b', 'app/d', 'app0', 'other']
+    s.close()
+
+
+def test_log_store_iter_items_pages_in_name_order(tmp_path):
+    log = LogStore(str(tmp_path / 'secrets.db'))
+    log.put_many([(f"n{i}", str(i)) for i in range(5)])
+    items = log.iter_items(page_size=2)
+    assert [next(items), next(items)] == [('n0', '0'), ('n1', '1')]
+    # Later pages see writes made while iterating
+    log.delete('n2')
+    log.put('n9', '9')
+    assert list(items) == [('n3', '3'), ('n4', '4'), ('n9', '9')]
+    log.close()
+
+
+@pytest.mark.parametrize('kind', [FileStore, LogStore])
+def test_unstorable_names_are_refused_without_leaving_files(tmp_path, kind):
+    s = kind(str(tmp_path / 'secrets.db'))
+    s.put('a', 'AAA')
+    with pytest.raises(ValueError):
+        s.put_many([('b', 'BBB'), ('x\nb', 'XXX')])
+    assert s.items() == [('a', 'AAA')]
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+    s.close()
+
+
+def test_store_missing_an_operation_fails_when_created():
+    class Incomplete(store.SecretStore):
+        def get(self, name):
+            return None
+
+        def items(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_background_thread_starts_once_per_process(monkeypatch):
+    started = []
+    release = threading.Event()
+
+    def target():
+        started.append(os.getpid())
+        release.wait(5)
+
+    worker = store.BackgroundThread(target, 'test-worker')
+    worker.ensure_running()
+    worker.ensure_running()
+    # After a fork the pid changes and the parent's thread is not running here
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    worker.ensure_running()
+    release.set()
+    deadline = time.monotonic() + 5
+    while len(started) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(started) == 2